@@ -0,0 +1,118 @@
+"""Ahead-of-time compilation of the SNR and SINAD kernels with numba.pycc
+
+This is used by setup.py to build the audioaliasingmetrics._aot extension, which
+removes the JIT compilation latency of the first call. When the extension is not
+available, the kernels are JIT compiled as usual.
+"""
+
+from types import FunctionType
+from typing import Dict
+
+from numba import njit
+from numba.core.registry import CPUDispatcher
+from numba.pycc import CC
+
+from .sinad import inner_sinad, INNER_SINAD_SIGNATURES
+from .snr import inner_snr, INNER_SNR_SIGNATURES
+
+
+def serial_kernel(
+    kernel: CPUDispatcher, built: Dict[CPUDispatcher, CPUDispatcher]
+) -> CPUDispatcher:
+    """Build a serial copy of a kernel, with the same options except parallel.
+    pycc can't link numba's parallel runtime, and prange behaves like range
+    in a serial kernel
+
+    Args:
+        kernel (CPUDispatcher): The jitted kernel
+        built (Dict[CPUDispatcher, CPUDispatcher]): The serial copies already built
+
+    Returns:
+        CPUDispatcher: The serial copy of the kernel
+    """
+    if kernel not in built:
+        options = dict(kernel.targetoptions)
+        options.pop("parallel", None)
+        # Implied by njit, which warns when it is given
+        options.pop("nopython", None)
+        built[kernel] = njit(**options)(serial_py_func(kernel.py_func, built))
+    return built[kernel]
+
+
+def serial_py_func(
+    py_func: FunctionType, built: Dict[CPUDispatcher, CPUDispatcher]
+) -> FunctionType:
+    """Copy a python function, with every kernel it references swapped for its serial
+    copy, so none of the kernels it calls, even indirectly, is parallel
+
+    Args:
+        py_func (FunctionType): The python function
+        built (Dict[CPUDispatcher, CPUDispatcher]): The serial copies already built
+
+    Returns:
+        FunctionType: The copy of the python function
+    """
+    func_globals = dict(py_func.__globals__)
+    for name in py_func.__code__.co_names:
+        value = func_globals.get(name)
+        if isinstance(value, CPUDispatcher):
+            func_globals[name] = serial_kernel(value, built)
+    return FunctionType(
+        py_func.__code__, func_globals, py_func.__name__, py_func.__defaults__
+    )
+
+
+def assert_serial(py_func: FunctionType):
+    """Check that none of the kernels a python function references is parallel, a
+    parallel kernel would make the extension fail to import
+
+    Args:
+        py_func (FunctionType): The python function
+    """
+    for name in py_func.__code__.co_names:
+        value = py_func.__globals__.get(name)
+        if isinstance(value, CPUDispatcher):
+            assert not value.targetoptions.get(
+                "parallel", False
+            ), "{} is parallel and can't be AOT compiled".format(value.py_func.__name__)
+
+
+serial_kernels = {}
+serial_inner_sinad = serial_kernel(inner_sinad, serial_kernels)
+serial_inner_snr = serial_kernel(inner_snr, serial_kernels)
+
+
+# pycc compiles the exported functions with numba's default options, the kernels
+# are called through these wrappers to keep their own options, error_model="numpy"
+# gives the same inf as the JIT on a zero noise power instead of ZeroDivisionError
+def export_inner_sinad(
+    noisy_magnitudes, clean_magnitudes, samplerate, fundamental, harmonics
+):
+    return serial_inner_sinad(
+        noisy_magnitudes, clean_magnitudes, samplerate, fundamental, harmonics
+    )
+
+
+def export_inner_snr(
+    periodigram, samplerate, fundamental, harmonics, harmonics_excluded
+):
+    return serial_inner_snr(
+        periodigram, samplerate, fundamental, harmonics, harmonics_excluded
+    )
+
+
+for py_func in [export_inner_sinad, export_inner_snr] + [
+    kernel.py_func for kernel in serial_kernels.values()
+]:
+    assert_serial(py_func)
+
+cc = CC("_aot")
+
+# One export per spectrum dtype, pycc doesn't dispatch on types
+for dtype, signature in INNER_SINAD_SIGNATURES.items():
+    cc.export("inner_sinad_" + dtype, signature)(export_inner_sinad)
+for dtype, signature in INNER_SNR_SIGNATURES.items():
+    cc.export("inner_snr_" + dtype, signature)(export_inner_snr)
+
+if __name__ == "__main__":
+    cc.compile()
@@ -1,11 +1,65 @@
 import numpy as np
-from numba import njit
-from typing import Union
+from numba import njit, types
+from typing import Tuple, Union
 
 from .utils import *
 
 
-@njit
+@njit(fastmath=True, cache=True, error_model="numpy")
+def clean_psd_and_nad_power(
+    noisy_magnitudes: np.ndarray[np.float32],
+    clean_magnitudes: np.ndarray[np.float32],
+    mag_ratio: float,
+    fund_lo: int,
+    fund_hi: int,
+) -> Tuple[np.ndarray[np.float32], float]:
+    """Compute the PSD of the clean signal and the noise & distortion power of the
+    normalized noisy signal in a single pass, without any intermediate noise array
+
+    Args:
+        noisy_magnitudes (np.ndarray[np.float32]): The spectral magnitude of the noisy signal
+        clean_magnitudes (np.ndarray[np.float32]): The spectral magnitude of the clean signal
+        mag_ratio (float): The normalization ratio to apply to the noisy magnitudes
+        fund_lo (int): The first bin of the fundamental, excluded from the noise & distortion power
+        fund_hi (int): The last bin of the fundamental, excluded from the noise & distortion power
+
+    Returns:
+        Tuple[np.ndarray[np.float32], float]: The PSD of the clean signal and the noise & distortion power
+    """
+    psd_clean = np.empty_like(clean_magnitudes)
+    nad_power = 0.0
+    for i in range(clean_magnitudes.shape[0]):
+        clean = clean_magnitudes[i]
+        noisy = noisy_magnitudes[i] * mag_ratio
+        psd_clean[i] = clean * clean
+        # Exclude DC and the fundamental
+        if i != 0 and (i < fund_lo or i > fund_hi):
+            noise = noisy - clean
+            nad_power += noise * noise
+
+    return psd_clean, nad_power
+
+
+def inner_sinad_signature(dtype: types.Float) -> Signature:
+    """The inner_sinad signature for C-contiguous spectra of the given float dtype"""
+    return types.float64(
+        dtype[::1],
+        dtype[::1],
+        types.float64,
+        types.float64,
+        HARMONICS_ARRAY_TYPE,
+    )
+
+
+# Explicit C-contiguous float32 and float64 signatures. Only compiled, eagerly
+# and with no type dispatch, when the AOT kernels can't be loaded
+INNER_SINAD_SIGNATURES = {
+    "float32": inner_sinad_signature(types.float32),
+    "float64": inner_sinad_signature(types.float64),
+}
+
+
+@njit(fastmath=True, cache=True, error_model="numpy")
 def inner_sinad(
     noisy_magnitudes: np.ndarray[np.float32],
     clean_magnitudes: np.ndarray[np.float32],
@@ -13,41 +67,47 @@ def inner_sinad(
     fundamental: float,
     harmonics: np.ndarray[np.int32],
 ) -> float:
+    # Frequency resolution and 10Hz search width, shared by all the peak searches
+    bins_per_hz = 2.0 * (noisy_magnitudes.shape[0] - 1) / samplerate
+    search_width = search_width_in_bins(10.0, bins_per_hz)
+
     # Normalize according to the magnitude of the fundamental :
-    fund_bin = find_peak_bin_from_freq(fundamental, noisy_magnitudes, samplerate)
-    fund_peak_bins = find_peak_bins(fund_bin, noisy_magnitudes)
+    fund_bin = find_peak_bin_from_bins_per_hz(
+        fundamental, noisy_magnitudes, bins_per_hz, search_width
+    )
+    fund_lo, fund_hi = find_peak_range(fund_bin, noisy_magnitudes)
 
-    mag_sum_noised = np.sum(noisy_magnitudes[fund_peak_bins[0] : fund_peak_bins[-1]])
-    mag_sum_clean = np.sum(clean_magnitudes[fund_peak_bins[0] : fund_peak_bins[-1]])
+    # Over the whole peak, the same bins as the signal power
+    mag_sum_noised = np.sum(noisy_magnitudes[fund_lo : fund_hi + 1])
+    mag_sum_clean = np.sum(clean_magnitudes[fund_lo : fund_hi + 1])
+    # Same dtype as the spectra, so the normalization doesn't upcast them
     mag_ratio = mag_sum_noised / mag_sum_clean
-    noisy_magnitudes *= mag_ratio
-    noise_magnitudes = noisy_magnitudes - clean_magnitudes
 
-    # Compute the PSD after normalization
-    psd_clean = np.square(clean_magnitudes)
-    psd_noise = np.square(noise_magnitudes)
-    psd_noisy = np.square(noisy_magnitudes)
+    # Compute the PSD and the noise & distortion power after normalization
+    psd_clean, nad_power = clean_psd_and_nad_power(
+        noisy_magnitudes, clean_magnitudes, mag_ratio, fund_lo, fund_hi
+    )
 
     # Find all the bins of the harmonics
-    harmonics_bins = np.empty((0), dtype=np.int32)
-    for harmonic_factor in harmonics:
-        harmonic = harmonic_factor * fundamental
-        harmonic_bin = find_peak_bin_from_freq(harmonic, psd_clean, samplerate)
-        harmonics_bins = np.append(
-            harmonics_bins, find_peak_bins(harmonic_bin, psd_noisy)
-        )
+    # Squaring and normalizing keep the magnitudes ordering, which is all
+    # find_peak_range relies on, so the noisy PSD is not needed
+    harmonics_ranges = find_harmonics_ranges(
+        harmonics, fundamental, psd_clean, noisy_magnitudes, bins_per_hz, search_width
+    )
 
     # Compute the signal power
-    signal_bins = np.concatenate((fund_peak_bins, harmonics_bins))
-    signal_power = np.sum(psd_clean[signal_bins])
-
-    # Compute the noise & distortion power
-    nad = np.delete(psd_noise, fund_peak_bins)
-    nad_power = np.sum(nad[1:])
+    signal_power = np.sum(psd_clean[fund_lo : fund_hi + 1]) + sum_ranges(
+        psd_clean, harmonics_ranges
+    )
 
     return 10 * np.log10((signal_power + nad_power) / nad_power)
 
 
+compiled_inner_sinad = compiled_kernels(
+    "inner_sinad", inner_sinad, INNER_SINAD_SIGNATURES
+)
+
+
 def sinad(
     noisy_magnitudes: np.ndarray[np.float32],
     clean_magnitudes: np.ndarray[np.float32],
@@ -87,19 +147,26 @@ def sinad(
 
         # Sort if needed
         if harmonics.shape[0] > 0:
-            harmonics = np.sort(harmonics)
+            if not is_sorted(harmonics):
+                harmonics = np.sort(harmonics)
             if harmonics[0] < 2:
                 raise ValueError("Harmonics values must be >=2")
-            top_harmonic = floor((samplerate / 2) / fundamental)
-            if harmonics[-1] > top_harmonic:
+            max_harmonic = top_harmonic(fundamental, samplerate)
+            if harmonics[-1] > max_harmonic:
                 raise ValueError(
                     "Given your fundamental, the highest harmonic value should be {}".format(
-                        top_harmonic
+                        max_harmonic
                     )
                 )
     else:
         harmonics = harmonics.compute_harmonics(fundamental, samplerate)
 
-    return inner_sinad(
-        noisy_magnitudes, clean_magnitudes, samplerate, fundamental, harmonics
+    # float32 spectra stay in float32, anything else is computed in float64
+    dtype = spectrum_dtype(noisy_magnitudes, clean_magnitudes)
+    return compiled_inner_sinad[dtype.name](
+        np.ascontiguousarray(noisy_magnitudes, dtype=dtype),
+        np.ascontiguousarray(clean_magnitudes, dtype=dtype),
+        float(samplerate),
+        float(fundamental),
+        np.ascontiguousarray(harmonics, dtype=np.int32),
     )
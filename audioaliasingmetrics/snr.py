@@ -1,11 +1,30 @@
 import numpy as np
-from numba import njit
+from numba import njit, types
 from typing import Union
 
 from .utils import *
 
 
-@njit
+def inner_snr_signature(dtype: types.Float) -> Signature:
+    """The inner_snr signature for C-contiguous spectra of the given float dtype"""
+    return types.float64(
+        dtype[::1],
+        types.float64,
+        types.float64,
+        HARMONICS_ARRAY_TYPE,
+        types.boolean,
+    )
+
+
+# Explicit C-contiguous float32 and float64 signatures. Only compiled, eagerly
+# and with no type dispatch, when the AOT kernels can't be loaded
+INNER_SNR_SIGNATURES = {
+    "float32": inner_snr_signature(types.float32),
+    "float64": inner_snr_signature(types.float64),
+}
+
+
+@njit(fastmath=True, cache=True, error_model="numpy")
 def inner_snr(
     periodigram: np.ndarray[np.float32],
     samplerate: float,
@@ -13,34 +32,39 @@ def inner_snr(
     harmonics: np.ndarray[np.int32],
     harmonics_excluded: bool,
 ) -> float:
-    # Find all the bins of the fundamental
-    fund_bin = find_peak_bin_from_freq(fundamental, periodigram, samplerate)
-    fund_peak_bins = find_peak_bins(fund_bin, periodigram)
-
-    # Find all the bins of the harmonics
-    harmonics_bins = np.empty((0), dtype=np.int32)
-    for harmonic_factor in harmonics:
-        harmonic = harmonic_factor * fundamental
-        harmonic_bin = find_peak_bin_from_freq(harmonic, periodigram, samplerate)
-        harmonics_bins = np.append(
-            harmonics_bins, find_peak_bins(harmonic_bin, periodigram)
-        )
+    # Frequency resolution and 10Hz search width, shared by all the peak searches
+    bins_per_hz = 2.0 * (periodigram.shape[0] - 1) / samplerate
+    search_width = search_width_in_bins(10.0, bins_per_hz)
+
+    # Find the range of bins of the fundamental
+    fund_bin = find_peak_bin_from_bins_per_hz(
+        fundamental, periodigram, bins_per_hz, search_width
+    )
+    fund_lo, fund_hi = find_peak_range(fund_bin, periodigram)
+
+    # Find the ranges of bins of the harmonics, after the fundamental
+    peak_ranges = np.empty((harmonics.shape[0] + 1, 2), dtype=np.int32)
+    peak_ranges[0, 0] = fund_lo
+    peak_ranges[0, 1] = fund_hi
+    peak_ranges[1:] = find_harmonics_ranges(
+        harmonics, fundamental, periodigram, periodigram, bins_per_hz, search_width
+    )
+
+    # Compute the power of all the peaks and the noise power
+    peaks_power, noise_power = split_power(periodigram, peak_ranges)
 
     # Compute the signal power
     if harmonics_excluded:
-        signal_bins = fund_peak_bins
+        signal_power = np.sum(periodigram[fund_lo : fund_hi + 1])
     else:
-        signal_bins = np.concatenate((fund_peak_bins, harmonics_bins))
-    signal_power = np.sum(periodigram[signal_bins])
-
-    # Compute the noise power
-    to_delete = np.concatenate((fund_peak_bins, harmonics_bins))
-    noise = np.delete(periodigram, to_delete)
-    noise_power = np.sum(noise[1:])  # Exclude DC
+        signal_power = peaks_power
 
     return 10 * np.log10(signal_power / noise_power)
 
 
+compiled_inner_snr = compiled_kernels("inner_snr", inner_snr, INNER_SNR_SIGNATURES)
+
+
 def snr(
     magnitude: np.ndarray[np.float32],
     samplerate: float,
@@ -81,20 +105,29 @@ def snr(
 
         # Sort if needed
         if harmonics.shape[0] > 0:
-            harmonics = np.sort(harmonics)
+            if not is_sorted(harmonics):
+                harmonics = np.sort(harmonics)
             if harmonics[0] < 2:
                 raise ValueError("Harmonics values must be >=2")
-            top_harmonic = floor((samplerate / 2) / fundamental)
-            if harmonics[-1] > top_harmonic:
+            max_harmonic = top_harmonic(fundamental, samplerate)
+            if harmonics[-1] > max_harmonic:
                 raise ValueError(
                     "Given your fundamental, the highest harmonic value should be {}".format(
-                        top_harmonic
+                        max_harmonic
                     )
                 )
 
     else:
         harmonics = harmonics.compute_harmonics(fundamental, samplerate)
 
-    return inner_snr(
-        np.square(magnitude), samplerate, fundamental, harmonics, harmonics_excluded
+    # float32 spectra stay in float32, anything else is computed in float64
+    dtype = spectrum_dtype(magnitude)
+    periodigram = np.square(np.asarray(magnitude, dtype=dtype))
+
+    return compiled_inner_snr[dtype.name](
+        periodigram,
+        float(samplerate),
+        float(fundamental),
+        np.ascontiguousarray(harmonics, dtype=np.int32),
+        bool(harmonics_excluded),
     )
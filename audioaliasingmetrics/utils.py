@@ -1,7 +1,16 @@
+import importlib
+import warnings
 import numpy as np
-from numba import njit
-from math import floor, ceil
+from numba import njit, prange, types
+from numba.core.registry import CPUDispatcher
+from numba.core.typing import Signature
 from enum import Enum
+from functools import lru_cache
+from typing import Callable, Dict, Tuple
+
+# Numba type of the harmonic factors given to the kernels. Read-only since
+# they may come from the Harmonics cache
+HARMONICS_ARRAY_TYPE = types.Array(types.int32, 1, "C", readonly=True)
 
 
 class Harmonics(Enum):
@@ -16,13 +25,132 @@ class Harmonics(Enum):
     def compute_harmonics(
         self, fundamental: float, samplerate: float
     ) -> np.ndarray[np.int32]:
-        nyquist = samplerate / 2.0
-        if self == Harmonics.ALL:
-            return np.arange(2, floor(nyquist / fundamental) + 1)
-        elif self == Harmonics.ODD:
-            return np.arange(3, floor(nyquist / fundamental) + 1, step=2)
-        else:
-            return np.arange(2, floor(nyquist / fundamental) + 1, step=2)
+        # The cached array is read-only, so callers can't alter the cache
+        return cached_harmonics(self, fundamental, samplerate).view()
+
+
+@lru_cache(maxsize=32)
+def cached_harmonics(
+    harmonics: Harmonics, fundamental: float, samplerate: float
+) -> np.ndarray[np.int32]:
+    """Build the read-only array of harmonic factors of a Harmonics value, memoized for
+    batch processing of many spectra with the same fundamental and samplerate
+
+    Args:
+        harmonics (Harmonics): The expected harmonics of the signal
+        fundamental (float): Fundamental frequency of the signal
+        samplerate (float): Samplerate
+
+    Returns:
+        np.ndarray[np.int32]: The harmonic factors, read-only
+    """
+    if harmonics == Harmonics.ALL:
+        factors = build_harmonics(2, 1, fundamental, samplerate)
+    elif harmonics == Harmonics.ODD:
+        factors = build_harmonics(3, 2, fundamental, samplerate)
+    else:
+        factors = build_harmonics(2, 2, fundamental, samplerate)
+    factors.setflags(write=False)
+    return factors
+
+
+def spectrum_dtype(*spectra: np.ndarray) -> np.dtype:
+    """Pick the dtype the kernels work in : float32 when all the spectra are float32,
+    float64 otherwise, so no spectrum is ever downcast
+
+    Returns:
+        np.dtype: float32 or float64
+    """
+    if all(np.asarray(spectrum).dtype == np.float32 for spectrum in spectra):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+def compiled_kernels(
+    name: str, jit_kernel: CPUDispatcher, signatures: Dict[str, Signature]
+) -> Dict[str, Callable]:
+    """Get the ahead-of-time compiled kernels of each dtype, built by setup.py when
+    numba.pycc is available. When the extension isn't built, the JIT kernel is compiled
+    eagerly for the signatures instead, with no type dispatch. The JIT kernel isn't
+    compiled at all when the extension is loaded. Warns when the extension is built
+    but can't be loaded
+
+    Args:
+        name (str): The name of the kernel, exported as <name>_<dtype> in the extension
+        jit_kernel (CPUDispatcher): The lazy JIT kernel
+        signatures (Dict[str, Signature]): The signature of the kernel for each dtype
+
+    Returns:
+        Dict[str, Callable]: The kernel to call for each dtype
+    """
+    module_name = __package__ + "._aot"
+    try:
+        module = importlib.import_module(module_name)
+        return {
+            dtype: getattr(module, "{}_{}".format(name, dtype)) for dtype in signatures
+        }
+    except ModuleNotFoundError as e:
+        if e.name != module_name:
+            warn_aot_fallback(module_name, name, e)
+    except (ImportError, AttributeError) as e:
+        warn_aot_fallback(module_name, name, e)
+
+    for signature in signatures.values():
+        jit_kernel.compile(signature)
+    jit_kernel.disable_compile()
+    return {dtype: jit_kernel for dtype in signatures}
+
+
+def warn_aot_fallback(module_name: str, name: str, error: Exception):
+    warnings.warn(
+        "Failed to load {} from {}, falling back to the JIT kernel : {}".format(
+            name, module_name, error
+        ),
+        stacklevel=3,
+    )
+
+
+def is_sorted(values: np.ndarray) -> bool:
+    """Check if an array is sorted in ascending order, without sorting it
+
+    Args:
+        values (np.ndarray): A 1D array
+
+    Returns:
+        bool: True if the array is sorted
+    """
+    return bool(np.all(values[1:] >= values[:-1]))
+
+
+def top_harmonic(fundamental: float, samplerate: float) -> int:
+    """Compute the highest harmonic factor below the Nyquist frequency
+
+    Args:
+        fundamental (float): Fundamental frequency of the signal
+        samplerate (float): Samplerate
+
+    Returns:
+        int: The highest harmonic factor
+    """
+    return int((samplerate * 0.5) / fundamental)
+
+
+def build_harmonics(
+    first: int, step: int, fundamental: float, samplerate: float
+) -> np.ndarray[np.int32]:
+    """Build a contiguous array of harmonic factors up to the Nyquist frequency
+
+    Args:
+        first (int): The first harmonic factor
+        step (int): The step between two consecutive harmonic factors
+        fundamental (float): Fundamental frequency of the signal
+        samplerate (float): Samplerate
+
+    Returns:
+        np.ndarray[np.int32]: The harmonic factors
+    """
+    last = top_harmonic(fundamental, samplerate)
+    return np.arange(first, last + 1, step, np.int32)
 
 
 # def interpolate_fundamental(ps: np.ndarray[float], sr: float) -> float:
@@ -51,7 +179,26 @@ class Harmonics(Enum):
 #     return closest_peak
 
 
-@njit
+@njit(fastmath=True, cache=True, error_model="numpy")
+def search_width_in_bins(search_width_hz: float, bins_per_hz: float) -> int:
+    """Convert a search width from Hz to a number of bins, rounded up
+
+    Args:
+        search_width_hz (float): The search width in Hz
+        bins_per_hz (float): Number of bins per Hz in the periodigram, (num_bins - 1) / (sr / 2)
+
+    Returns:
+        int: The search width in number of bins
+    """
+    # Integer ceil, truncation is a floor for positive values
+    width = search_width_hz * bins_per_hz
+    width_bins = int(width)
+    if width_bins < width:
+        width_bins += 1
+    return width_bins
+
+
+@njit(fastmath=True, cache=True, error_model="numpy")
 def find_peak_bin_from_freq(
     freq_hint: float, ps: np.ndarray[float], sr: float, search_width_hz=10
 ) -> int:
@@ -63,12 +210,34 @@ def find_peak_bin_from_freq(
         sr (float): samplerate
         search_width_hz (int, optional): Width of the search area for the peak. Defaults to 10.
 
+    Returns:
+        int: The index of the bin
+    """
+    bins_per_hz = 2.0 * (ps.shape[0] - 1) / sr
+    search_width = search_width_in_bins(search_width_hz, bins_per_hz)
+
+    return find_peak_bin_from_bins_per_hz(freq_hint, ps, bins_per_hz, search_width)
+
+
+@njit(fastmath=True, cache=True, error_model="numpy")
+def find_peak_bin_from_bins_per_hz(
+    freq_hint: float, ps: np.ndarray[float], bins_per_hz: float, search_width: int
+) -> int:
+    """Find the index of the bin of the highest point of a frequency peak, given the
+    frequency resolution of the periodigram. Use this instead of find_peak_bin_from_freq
+    when searching several peaks in the same periodigram, to compute the resolution only once
+
+    Args:
+        freq_hint (float): The expected frequency of the peak
+        ps (np.ndarray[float]): The periodigram
+        bins_per_hz (float): Number of bins per Hz in the periodigram, (num_bins - 1) / (sr / 2)
+        search_width (int): Half width (in number of bins) of the search area for the peak
+
     Returns:
         int: The index of the bin
     """
     num_bins = ps.shape[0]
-    hint_idx = floor(2.0 * freq_hint / sr * (num_bins - 1))
-    search_width = ceil(search_width_hz / (sr / 2.0) * (num_bins - 1))
+    hint_idx = int(freq_hint * bins_per_hz)
     left_limit = hint_idx - search_width
     search_center = search_width
     if left_limit < 0:
@@ -77,19 +246,17 @@ def find_peak_bin_from_freq(
     right_limit = min(num_bins, hint_idx + search_width + 1)
     search_slice = ps[left_limit:right_limit]
 
-    return (
-        find_nearest_peak_around(search_slice, search_center, search_width)
-        + hint_idx
-        - search_width
-    )
+    peak_idx = find_nearest_peak_around(search_slice, search_center, search_width)
+    return peak_idx + left_limit
 
 
-@njit
-def is_peak(slice_of_3: np.ndarray[float]) -> bool:
-    return slice_of_3[1] > slice_of_3[0] and slice_of_3[1] > slice_of_3[2]
+@njit(fastmath=True, cache=True, error_model="numpy", inline="always")
+def is_peak(left: float, value: float, right: float) -> bool:
+    # Bitwise and on purpose, to avoid a short-circuit branch
+    return (value > left) & (value > right)
 
 
-@njit
+@njit(fastmath=True, cache=True, error_model="numpy")
 def find_nearest_peak_around(
     ps_slice: np.ndarray[float], center: int, search_width: int
 ) -> int:
@@ -103,29 +270,48 @@ def find_nearest_peak_around(
     Returns:
         int: The index of the bin
     """
-    center = ps_slice.shape[0] // 2
+    # A probe needs both neighbours inside the slice, the center can be the first
+    # or the last bin when the hint is on DC or on Nyquist
+    last_idx = ps_slice.shape[0] - 1
     for i in range(0, search_width):
         # right side first
         right_idx = center + i
-        if right_idx + 1 < ps_slice.shape[0] and is_peak(
-            ps_slice[right_idx - 1 : right_idx + 2]
+        if (
+            right_idx - 1 >= 0
+            and right_idx + 1 <= last_idx
+            and is_peak(
+                ps_slice[right_idx - 1], ps_slice[right_idx], ps_slice[right_idx + 1]
+            )
         ):
             return right_idx
 
         # left side then
         left_idx = center - i
-        if left_idx - 1 >= 0 and is_peak(ps_slice[left_idx - 1 : left_idx + 2]):
+        if (
+            left_idx - 1 >= 0
+            and left_idx + 1 <= last_idx
+            and is_peak(
+                ps_slice[left_idx - 1], ps_slice[left_idx], ps_slice[left_idx + 1]
+            )
+        ):
             return left_idx
 
-    # fallback
-    return np.argmax(ps_slice)
+    # fallback, the slice is small enough for a scalar argmax
+    best_idx = 0
+    best_val = ps_slice[0]
+    for i in range(1, ps_slice.shape[0]):
+        if ps_slice[i] > best_val:
+            best_val = ps_slice[i]
+            best_idx = i
+    return best_idx
 
 
-@njit
-def find_peak_bins(
+@njit(fastmath=True, cache=True, error_model="numpy")
+def find_peak_range(
     peak_idx: int, ps: np.ndarray[float], search_width=1000
-) -> np.ndarray[np.int32]:
-    """Given the index of the bin of a peak, this will find all the bins of the peak
+) -> Tuple[int, int]:
+    """Given the index of the bin of a peak, this will find the range of bins of the peak.
+    The bins of a peak are contiguous, so the range is enough to slice them without any gather
 
     Args:
         peak_idx (int): the index of the highest point of the peak
@@ -133,33 +319,136 @@ def find_peak_bins(
         search_width (int, optional): The width (in number of bins) for the search. Defaults to 1000.
 
     Returns:
-        np.ndarray[int]: An array of all the bins of the peak, ordered
+        Tuple[int, int]: The first and the last bins of the peak, both included
     """
-    peak_bins = []
     peak = ps[peak_idx]
 
     # Find values before peak
+    lo = peak_idx
     crt_val = peak
-    for i in range(search_width):
+    for i in range(1, search_width):
         new_bin = peak_idx - i
         if new_bin < 0:
             break
         new_val = ps[new_bin]
         if new_val > crt_val:
             break
-        peak_bins.append(new_bin)
+        lo = new_bin
         crt_val = new_val
 
     # Find values after peak
+    hi = peak_idx
     crt_val = peak
-    for i in range(search_width):
+    for i in range(1, search_width):
         new_bin = peak_idx + i
         if new_bin >= ps.shape[0]:
             break
         new_val = ps[new_bin]
         if new_val > crt_val:
             break
-        peak_bins.append(new_bin)
+        hi = new_bin
         crt_val = new_val
 
-    return np.array(peak_bins, dtype=np.int32)
+    return lo, hi
+
+
+@njit(parallel=True, fastmath=True, cache=True, error_model="numpy")
+def find_harmonics_ranges(
+    harmonics: np.ndarray[np.int32],
+    fundamental: float,
+    search_ps: np.ndarray[float],
+    peak_ps: np.ndarray[float],
+    bins_per_hz: float,
+    search_width: int,
+) -> np.ndarray[np.int32]:
+    """Find the range of bins of all the harmonics peaks, searching the harmonics in parallel
+
+    Args:
+        harmonics (np.ndarray[np.int32]): The harmonic factors
+        fundamental (float): Fundamental frequency of the signal
+        search_ps (np.ndarray[float]): The periodigram in which to search the highest point of each peak
+        peak_ps (np.ndarray[float]): The periodigram in which to find the bins of each peak
+        bins_per_hz (float): Number of bins per Hz in the periodigram, (num_bins - 1) / (sr / 2)
+        search_width (int): Half width (in number of bins) of the search area for each peak
+
+    Returns:
+        np.ndarray[np.int32]: A (num_harmonics, 2) array of the first and last bins of each peak,
+            both included, ordered by harmonic
+    """
+    harmonics_freqs = harmonics.astype(np.float64) * fundamental
+    num_harmonics = harmonics_freqs.shape[0]
+
+    ranges = np.empty((num_harmonics, 2), dtype=np.int32)
+    for h in prange(num_harmonics):
+        harmonic_bin = find_peak_bin_from_bins_per_hz(
+            harmonics_freqs[h], search_ps, bins_per_hz, search_width
+        )
+        lo, hi = find_peak_range(harmonic_bin, peak_ps)
+        ranges[h, 0] = lo
+        ranges[h, 1] = hi
+
+    return ranges
+
+
+@njit(fastmath=True, cache=True, error_model="numpy")
+def sum_ranges(ps: np.ndarray[float], ranges: np.ndarray[np.int32]) -> float:
+    """Sum the periodigram over the given ranges of bins, with contiguous loads only
+
+    Args:
+        ps (np.ndarray[float]): the periodigram
+        ranges (np.ndarray[np.int32]): A (num_ranges, 2) array of the first and last bins of each range, both included
+
+    Returns:
+        float: The sum over all the ranges
+    """
+    total = 0.0
+    for r in range(ranges.shape[0]):
+        for i in range(ranges[r, 0], ranges[r, 1] + 1):
+            total += ps[i]
+    return total
+
+
+@njit(fastmath=True, cache=True, error_model="numpy")
+def split_power(
+    ps: np.ndarray[float], peak_ranges: np.ndarray[np.int32]
+) -> Tuple[float, float]:
+    """Split the power of the periodigram between the given ranges of bins and all the others.
+    A single walk over the sorted ranges sums the ranges and the gaps between them, so each
+    bin is read once and the remaining power is never derived from a subtraction, which would
+    cancel out a noise far below the peaks. DC is part of the power of a peak reaching it,
+    but is always excluded from the remaining power.
+
+    Args:
+        ps (np.ndarray[float]): the periodigram
+        peak_ranges (np.ndarray[np.int32]): A (num_peaks, 2) array of the first and last bins of each peak,
+            both included. Ranges may overlap
+
+    Returns:
+        Tuple[float, float]: The power of the peak bins and the power of the remaining bins
+    """
+    # Peaks are found in ascending frequency order, only sort in the unlikely case they are not
+    order = np.arange(peak_ranges.shape[0])
+    for r in range(1, peak_ranges.shape[0]):
+        if peak_ranges[r, 0] < peak_ranges[r - 1, 0]:
+            order = np.argsort(peak_ranges[:, 0])
+            break
+
+    # Skip the bins already covered by a previous range, so overlapping
+    # ranges are only counted once
+    peaks_power = 0.0
+    noise_power = 0.0
+    covered_hi = -1
+    for r in order:
+        # The gap between the previous ranges and this one, without DC
+        for i in range(max(covered_hi + 1, 1), peak_ranges[r, 0]):
+            noise_power += ps[i]
+        start = max(peak_ranges[r, 0], covered_hi + 1)
+        for i in range(start, peak_ranges[r, 1] + 1):
+            peaks_power += ps[i]
+        covered_hi = max(covered_hi, peak_ranges[r, 1])
+
+    # The bins after the last range, without DC
+    for i in range(max(covered_hi + 1, 1), ps.shape[0]):
+        noise_power += ps[i]
+
+    return peaks_power, noise_power
@@ -1,9 +1,52 @@
+import os
+import sys
+import warnings
+
 from setuptools import setup
 from setuptools import find_packages
 
 with open("README.md", encoding="utf-8") as fh:
     long_description = fh.read()
 
+# The build backend doesn't put the project on the path, _aot_build is imported
+# from the sources
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+cmdclass = {}
+try:
+    # Ahead-of-time compile the kernels when numba is available at build time,
+    # otherwise they are JIT compiled on their first call
+    from audioaliasingmetrics._aot_build import cc
+
+    ext_modules = [cc.distutils_extension(optional=True)]
+
+    # Imported after creating the extension, numba patches build_ext to compile the
+    # kernels to object files before the extension is built
+    from setuptools.command.build_ext import build_ext
+
+    class optional_build_ext(build_ext):
+        """Skips the AOT extension when it fails to build, without a C compiler
+        for instance, the kernels are then JIT compiled on their first call
+        """
+
+        def build_extension(self, ext):
+            try:
+                build_ext.build_extension(self, ext)
+            except Exception as e:
+                warnings.warn(
+                    "Failed to build {}, the kernels will be JIT compiled : {}".format(
+                        ext.name, e
+                    )
+                )
+
+    cmdclass["build_ext"] = optional_build_ext
+except ImportError:
+    ext_modules = []
+except RuntimeError as e:
+    # Raised by numba.pycc when no C compiler is found
+    warnings.warn("The kernels will be JIT compiled : {}".format(e))
+    ext_modules = []
+
 setup(
     name="pyaudioaliasingmetrics",
     version="0.1.0",
@@ -23,4 +66,6 @@ setup(
         "Topic :: Multimedia :: Sound/Audio :: Analysis",
     ],
     packages=find_packages(),
+    ext_modules=ext_modules,
+    cmdclass=cmdclass,
 )
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from audioaliasingmetrics.utils import find_nearest_peak_around
+
+
+def test_hint_on_dc():
+    # The center is the first bin of the slice, it has no left neighbour and
+    # must not be compared with the last bin of the slice
+    ps_slice = np.array([3.0, 1.0, 2.0, 9.0, 2.0, 1.0, 0.0])
+    assert find_nearest_peak_around(ps_slice, 0, 5) == 3
+
+
+def test_hint_on_nyquist():
+    # The center is the last bin of the slice, it has no right neighbour. Pure
+    # python indexing raises on any read past the end of the slice
+    ps_slice = np.array([0.0, 1.0, 2.0, 3.0, 9.0])
+    assert find_nearest_peak_around.py_func(ps_slice, 4, 5) == 4
+
+
+HARMONIC_ON_NYQUIST = """
+import numpy as np
+import audioaliasingmetrics as aam
+
+# At 48kHz, the 24th harmonic of 1kHz sits exactly on Nyquist
+sr, n, f = 48000, 48000, 1000.0
+t = np.arange(n) / sr
+clean = sum(np.sin(2 * np.pi * k * f * t) / k for k in range(1, 24))
+noisy = clean + 1e-3 * np.random.default_rng(0).standard_normal(n)
+window = np.kaiser(n, 38)
+noisy_magnitude = np.abs(np.fft.rfft(noisy * window))
+clean_magnitude = np.abs(np.fft.rfft(clean * window))
+
+aam.snr(noisy_magnitude, sr, f, aam.Harmonics.ALL)
+aam.snr(noisy_magnitude, sr, f, aam.Harmonics.EVEN)
+aam.sinad(noisy_magnitude, clean_magnitude, sr, f, aam.Harmonics.ALL)
+"""
+
+
+def test_harmonic_on_nyquist_in_bounds():
+    # Out of bounds reads only raise with numba's bounds checking, which has to be
+    # enabled before compiling, so the kernels are compiled in a fresh process
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, NUMBA_BOUNDSCHECK="1", NUMBA_CACHE_DIR=cache_dir)
+        result = subprocess.run(
+            [sys.executable, "-c", HARMONIC_ON_NYQUIST],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    assert result.returncode == 0, result.stderr
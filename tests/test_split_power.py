@@ -0,0 +1,53 @@
+import numpy as np
+
+import audioaliasingmetrics as aam
+from audioaliasingmetrics.utils import split_power
+
+
+def masked_noise_power(ps, peak_ranges):
+    mask = np.ones(ps.shape[0], dtype=bool)
+    mask[0] = False  # Exclude DC
+    for lo, hi in peak_ranges:
+        mask[lo : hi + 1] = False
+    return np.sum(ps[mask].astype(np.float64))
+
+
+def test_noise_far_below_the_peaks():
+    # The noise is ~1e-16 of the peaks power, a total minus peaks difference
+    # would only keep rounding errors
+    rng = np.random.default_rng(0)
+    ps = (1e-12 * rng.random(2048)).astype(np.float32)
+    peak_ranges = np.array([[10, 20], [15, 30], [500, 520], [2040, 2047]], np.int32)
+    for lo, hi in peak_ranges:
+        ps[lo : hi + 1] += 1e4
+
+    _, noise_power = split_power(ps, peak_ranges)
+    np.testing.assert_allclose(
+        noise_power, masked_noise_power(ps, peak_ranges), rtol=1e-6
+    )
+
+
+def test_peaks_cover_every_bin():
+    # 20Hz harmonics 1.9 bins apart, the peaks leave no noise bin
+    samplerate, fundamental, length = 44100, 20.0, 4094
+    t = np.arange(length) / samplerate
+    saw = sum(
+        np.sin(2 * np.pi * k * fundamental * t) / k
+        for k in range(1, int(samplerate / 2 / fundamental) + 1)
+    )
+    magnitude = np.abs(np.fft.rfft(saw * np.kaiser(length, 38)))
+
+    assert aam.snr(magnitude, samplerate, fundamental, aam.Harmonics.ALL) == np.inf
+
+
+def test_dc_in_fundamental_peak():
+    # The 20Hz peak reaches DC, without harmonics both modes have the same signal power
+    samplerate, fundamental, length = 44100, 20.0, 8190
+    t = np.arange(length) / samplerate
+    noisy = np.sin(2 * np.pi * fundamental * t)
+    noisy += 1e-3 * np.random.default_rng(0).standard_normal(length)
+    magnitude = np.abs(np.fft.rfft(noisy * np.kaiser(length, 38)))
+
+    assert aam.snr(magnitude, samplerate, fundamental, []) == aam.snr(
+        magnitude, samplerate, fundamental, [], True
+    )